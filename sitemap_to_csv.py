@@ -9,69 +9,348 @@ Usage:
 from __future__ import annotations
 
 import argparse
+import contextlib
 import csv
+import functools
+import gzip
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import socket
 import ssl
 import sys
-import urllib.request
+import threading
+import time
 import urllib.parse
-from typing import Iterable, Set
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
 
-from xml.etree import ElementTree as ET
+import urllib3
+
+try:  # libxml2-backed parser when available; tolerant of large or slightly broken files
+    from lxml import etree as ET
+
+    _ITERPARSE_OPTIONS = {"huge_tree": True, "recover": True}
+except ImportError:  # pragma: no cover
+    from xml.etree import ElementTree as ET
+
+    _ITERPARSE_OPTIONS = {}
 
 XML_NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
-NS = {"sm": XML_NAMESPACE}
+URLSET_TAG = f"{{{XML_NAMESPACE}}}urlset"
+SITEMAPINDEX_TAG = f"{{{XML_NAMESPACE}}}sitemapindex"
+LOC_TAG = f"{{{XML_NAMESPACE}}}loc"
+ENTRY_TAGS = (f"{{{XML_NAMESPACE}}}url", f"{{{XML_NAMESPACE}}}sitemap")
+_ROOT_RE = re.compile(rb"<(urlset|sitemapindex)(?:\s[^>]*)?>")
+_DEFAULT_NS_RE = re.compile(
+    rb"""\sxmlns\s*=\s*["']""" + re.escape(XML_NAMESPACE.encode()) + rb"""["']"""
+)
+_XML_ENCODING_RE = re.compile(rb"""<\?xml[^>]*?\sencoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+_LOC_RE = re.compile(rb"<loc(?:\s[^>]*)?>\s*([^<\s][^<]*?)\s*</loc>")
+DEFAULT_MAX_WORKERS = 8
+MAX_WORKERS_LIMIT = 64
+MAX_SITEMAPS = 10_000
+MAX_URLS = 10_000_000
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36"
+)
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sitemap-csv")
+CACHE_TTL = 3600
+
+_system_getaddrinfo = socket.getaddrinfo
+_dns_cache_lock = threading.Lock()
+_dns_cache_users = 0
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    return _system_getaddrinfo(host, port, family, type, proto, flags)
 
 
-def fetch_xml(url: str, cert_file: str | None = None) -> bytes:
-    """Retrieve the raw bytes of an XML document."""
-    context = ssl.create_default_context()
+@contextlib.contextmanager
+def _dns_cache() -> Iterator[None]:
+    """Resolve each host once for the duration of a crawl instead of once per connection."""
+    global _dns_cache_users
+    with _dns_cache_lock:
+        if _dns_cache_users == 0:
+            _cached_getaddrinfo.cache_clear()
+            socket.getaddrinfo = _cached_getaddrinfo
+        _dns_cache_users += 1
+    try:
+        yield
+    finally:
+        with _dns_cache_lock:
+            _dns_cache_users -= 1
+            if _dns_cache_users == 0:
+                socket.getaddrinfo = _system_getaddrinfo
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context(cert_file: str | None = None) -> ssl.SSLContext:
+    """Build (once per CA bundle) the TLS context shared by every fetch."""
     if cert_file:
-        context = ssl.create_default_context(cafile=cert_file)
-
-    req = urllib.request.Request(
-        url,
-        headers={
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
-        },
+        return ssl.create_default_context(cafile=cert_file)
+    return ssl.create_default_context()
+
+
+@functools.lru_cache(maxsize=None)
+def _pool(cert_file: str | None = None) -> urllib3.PoolManager:
+    """Connection pool (one per CA bundle) so fetches to the same host reuse sockets."""
+    return urllib3.PoolManager(
+        num_pools=4,
+        # One kept-alive connection per worker, so no crawl ever discards and reopens sockets.
+        maxsize=MAX_WORKERS_LIMIT,
+        ssl_context=_ssl_context(cert_file),
+        # urllib3 transparently decodes compressed bodies (decode_content defaults to True).
+        headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"},
     )
-    with urllib.request.urlopen(req, context=context) as response:
-        return response.read()
+
+
+def _request(
+    url: str,
+    cert_file: str | None = None,
+    headers: Dict[str, str] | None = None,
+    **kwargs,
+) -> urllib3.BaseHTTPResponse:
+    pool = _pool(cert_file)
+    if headers:
+        kwargs["headers"] = {**pool.headers, **headers}
+    response = pool.request("GET", url, **kwargs)
+    if response.status >= 400:
+        response.drain_conn()
+        raise ValueError(f"HTTP {response.status} fetching {url}")
+    return response
+
+
+def _tmp_path(path: str) -> str:
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+
+
+def _fetch_cached(url: str, cert_file: str | None, cache_dir: str) -> bytes:
+    """Serve a sitemap from cache_dir while fresh, revalidating with the server once stale."""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    body_path = os.path.join(cache_dir, f"{key}.xml")
+    meta_path = os.path.join(cache_dir, f"{key}.meta.json")
+
+    try:
+        with open(meta_path, encoding="utf-8") as fh:
+            meta = json.load(fh)
+        with open(body_path, "rb") as fh:
+            cached = fh.read()
+    except (OSError, ValueError):
+        meta, cached = {}, None
+
+    headers: Dict[str, str] = {}
+    if cached is not None:
+        if time.time() - meta.get("fetched_at", 0) < CACHE_TTL:
+            return cached
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = _request(url, cert_file, headers=headers)
+    data = cached if response.status == 304 and cached is not None else response.data
+    meta = {
+        "fetched_at": time.time(),
+        "etag": response.headers.get("ETag") or meta.get("etag"),
+        "last_modified": response.headers.get("Last-Modified") or meta.get("last_modified"),
+    }
+    try:  # a read-only or full cache directory should never fail the crawl
+        os.makedirs(cache_dir, exist_ok=True)
+        if data is not cached:
+            _write_atomic(body_path, data)
+        _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+    except OSError:
+        pass
+    return data
+
+
+def fetch_xml(url: str, cert_file: str | None = None, cache_dir: str | None = None) -> bytes:
+    """Retrieve the raw bytes of an XML document (through the on-disk cache if cache_dir is set).
+
+    Gzipped files such as sitemap.xml.gz are decompressed; the cache keeps them compressed.
+    """
+    if cache_dir:
+        data = _fetch_cached(url, cert_file, cache_dir)
+    else:
+        data = _request(url, cert_file).data
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return data
 
 
 def is_xml_link(url: str) -> bool:
-    """Detect whether the link looks like a sitemap (ends with .xml)."""
-    return url.lower().rstrip("/").endswith(".xml")
+    """Detect whether the link looks like a sitemap (ends with .xml or .xml.gz)."""
+    if url[-1:] not in ("l", "L", "z", "Z", "/"):  # cheap reject for ordinary page URLs
+        return False
+    return url.rstrip("/")[-7:].lower().endswith((".xml", ".xml.gz"))
 
 
-def parse_sitemap(url: str, seen_xml: Set[str], emit: Set[str], cert_file: str | None = None) -> None:
-    """Recursively walk a sitemap, adding URL targets into the emit set."""
-    if url in seen_xml:
-        return
-    seen_xml.add(url)
+def extract_locs(data: bytes) -> List[str]:
+    """Pull every <loc> value out of raw sitemap bytes without building an XML tree."""
+    locs: List[str] = []
+    for match in _LOC_RE.finditer(data):
+        loc = match.group(1).decode("utf-8")
+        if "&" in loc:
+            loc = html.unescape(loc)
+        locs.append(loc)
+    return locs
 
-    data = fetch_xml(url, cert_file)
-    root = ET.fromstring(data)
-    tag = root.tag.split("}", 1)[-1]
 
-    if tag == "sitemapindex":
-        for sitemap in root.findall("sm:sitemap", NS):
-            loc_element = sitemap.find("sm:loc", NS)
-            if loc_element is None or not loc_element.text:
-                continue
-            parse_sitemap(loc_element.text.strip(), seen_xml, emit, cert_file=cert_file)
-    elif tag == "urlset":
-        for url_entry in root.findall("sm:url", NS):
-            loc_element = url_entry.find("sm:loc", NS)
-            if loc_element is None or not loc_element.text:
+def _parse_entries(source) -> Tuple[List[str], List[str]]:
+    """Strictly parse a sitemap document into (nested sitemaps, page URLs).
+
+    The document is parsed incrementally and every finished entry is discarded, so
+    memory stays flat regardless of how many <url> elements the sitemap holds.
+    """
+    nested: List[str] = []
+    pages: List[str] = []
+    root = None
+    is_index = False
+    for event, elem in ET.iterparse(source, events=("start", "end"), **_ITERPARSE_OPTIONS):
+        if root is None:
+            root = elem
+            if root.tag not in (URLSET_TAG, SITEMAPINDEX_TAG):
+                raise ValueError(f"Unsupported sitemap root tag: {root.tag}")
+            is_index = root.tag == SITEMAPINDEX_TAG
+        elif event != "end":
+            continue
+        elif elem.tag == LOC_TAG:
+            loc = (elem.text or "").strip()
+            if not loc:
                 continue
-            loc = loc_element.text.strip()
-            if is_xml_link(loc):
-                parse_sitemap(loc, seen_xml, emit, cert_file=cert_file)
+            if is_index or is_xml_link(loc):
+                nested.append(loc)
             else:
-                emit.add(loc)
-    else:
-        raise ValueError(f"Unsupported sitemap root tag: {root.tag}")
+                pages.append(loc)
+        elif elem.tag in ENTRY_TAGS:
+            root.clear()
+    return nested, pages
+
+
+def read_sitemap(
+    url: str,
+    cert_file: str | None = None,
+    strict_xml: bool = False,
+    cache_dir: str | None = None,
+) -> Tuple[List[str], List[str]]:
+    """Fetch a single sitemap and split its entries into (nested sitemaps, page URLs).
+
+    By default <loc> values are scanned straight out of the raw bytes; documents the
+    scan cannot make sense of (or every document, with strict_xml) go through the
+    XML parser instead.
+    """
+    if strict_xml and not cache_dir:
+        response = _request(url, cert_file, preload_content=False)
+        # The BufferedReader and parsers may read again after EOF, which must not hit a closed file.
+        response.auto_close = False
+        try:
+            stream = io.BufferedReader(response)
+            if stream.peek(2)[:2] == GZIP_MAGIC:
+                return _parse_entries(gzip.GzipFile(fileobj=stream))
+            return _parse_entries(stream)
+        finally:
+            response.drain_conn()
+            response.release_conn()
+
+    data = fetch_xml(url, cert_file, cache_dir)
+    if strict_xml:
+        return _parse_entries(io.BytesIO(data))
+    root = _ROOT_RE.search(data, 0, 4096)
+    if (
+        root is None
+        or not _DEFAULT_NS_RE.search(root.group(0))
+        or b"<!--" in data
+        or b"<![CDATA[" in data
+    ):
+        # The scan only understands a plain <urlset>/<sitemapindex> in the sitemap
+        # namespace with no comments or CDATA; the parser handles (or rejects) the rest.
+        return _parse_entries(io.BytesIO(data))
+    is_index = root.group(1) == b"sitemapindex"
+    declaration = _XML_ENCODING_RE.match(data.lstrip(b"\xef\xbb\xbf \t\r\n")[:200])
+    if declaration and declaration.group(1).lower() not in (b"utf-8", b"utf8"):
+        # The scan decodes as UTF-8; other declared encodings need the parser.
+        return _parse_entries(io.BytesIO(data))
+    try:
+        locs = extract_locs(data)
+    except UnicodeDecodeError:
+        return _parse_entries(io.BytesIO(data))
+    if not locs:
+        return _parse_entries(io.BytesIO(data))
+    if is_index:
+        return locs, []
+
+    nested: List[str] = []
+    pages: List[str] = []
+    for loc in locs:
+        if is_xml_link(loc):
+            nested.append(loc)
+        else:
+            pages.append(loc)
+    return nested, pages
+
+
+def parse_sitemap(
+    url: str,
+    seen_xml: Set[str],
+    emit: Callable[[str], None],
+    cert_file: str | None = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    strict_xml: bool = False,
+    strip_domain: bool = False,
+    cache_dir: str | None = None,
+    max_sitemaps: int = MAX_SITEMAPS,
+    max_urls: int = MAX_URLS,
+) -> None:
+    """Walk a sitemap hierarchy, calling emit for every URL target as it is discovered.
+
+    Nested sitemaps are fetched concurrently on a thread pool as soon as they are
+    discovered; bookkeeping stays on the calling thread, so no locking is needed.
+    Crawls that would fetch more than max_sitemaps sitemaps or emit more than
+    max_urls URLs are aborted with ValueError.
+    """
+    if not 1 <= max_workers <= MAX_WORKERS_LIMIT:
+        raise ValueError(f"max_workers must be between 1 and {MAX_WORKERS_LIMIT}, got {max_workers}")
+    if url in seen_xml:
+        return
+    seen_xml.add(url)
+
+    with _dns_cache():
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        pending: Set[Future] = {pool.submit(read_sitemap, url, cert_file, strict_xml, cache_dir)}
+        emitted = 0
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    nested, pages = future.result()
+                    emitted += len(pages)
+                    if emitted > max_urls:
+                        raise ValueError(f"Sitemap hierarchy lists more than {max_urls} URLs")
+                    for page in pages:
+                        emit(_strip_domain(page) if strip_domain else page)
+                    for loc in nested:
+                        if loc in seen_xml:
+                            continue
+                        if len(seen_xml) >= max_sitemaps:
+                            raise ValueError(f"Sitemap hierarchy has more than {max_sitemaps} sitemaps")
+                        seen_xml.add(loc)
+                        pending.add(pool.submit(read_sitemap, loc, cert_file, strict_xml, cache_dir))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
 
 
 def _strip_domain(url: str) -> str:
@@ -90,24 +369,107 @@ def collect_urls(
     root_sitemap: str,
     cert_file: str | None = None,
     strip_domain: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    strict_xml: bool = False,
+    cache_dir: str | None = None,
 ) -> Set[str]:
     """Return every (non-XML) URL mentioned inside the sitemap hierarchy."""
     seen_xml: Set[str] = set()
     collected: Set[str] = set()
-    parse_sitemap(root_sitemap, seen_xml, collected, cert_file=cert_file)
-    if strip_domain:
-        return {_strip_domain(url) for url in collected}
-    return collected
+    parse_sitemap(
+        root_sitemap,
+        seen_xml,
+        collected.add,
+        cert_file=cert_file,
+        max_workers=max_workers,
+        strict_xml=strict_xml,
+        strip_domain=strip_domain,
+        cache_dir=cache_dir,
+    )
     return collected
 
 
+def format_csv(urls: Sequence[str]) -> str:
+    """Render URLs (in the given order) as CSV text with a single `url` column."""
+    body = "\r\n".join(urls)
+    rows = len(urls)
+    # Plain URLs need no quoting, so the whole file is one join instead of a writerow per URL.
+    plain = (
+        "" not in urls  # csv.writer quotes an empty field as ""
+        and body.count("\n") == rows - 1
+        and body.count("\r") == rows - 1
+        and "," not in body
+        and '"' not in body
+    )
+    if rows and plain:
+        return f"url\r\n{body}\r\n"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["url"])
+    writer.writerows([url] for url in urls)
+    return buffer.getvalue()
+
+
+def stream_csv(
+    root_sitemap: str,
+    path: str,
+    cert_file: str | None = None,
+    strip_domain: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    strict_xml: bool = False,
+    cache_dir: str | None = None,
+) -> int:
+    """Write URLs to CSV in discovery order while crawling; returns the number of unique URLs.
+
+    Rows go to a temporary file next to path, which replaces path only once the
+    crawl succeeds, so a failed crawl leaves any existing file untouched.
+    """
+    written: Set[str] = set()
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["url"])
+
+            def emit(url: str) -> None:
+                if url not in written:
+                    written.add(url)
+                    writer.writerow([url])
+
+            parse_sitemap(
+                root_sitemap,
+                set(),
+                emit,
+                cert_file=cert_file,
+                max_workers=max_workers,
+                strict_xml=strict_xml,
+                strip_domain=strip_domain,
+                cache_dir=cache_dir,
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    return len(written)
+
+
 def write_csv(urls: Iterable[str], path: str) -> None:
     """Write URLs to CSV with a single `url` column."""
+    text = format_csv(sorted(urls))
     with open(path, "w", newline="", encoding="utf-8") as fh:
-        writer = csv.writer(fh)
-        writer.writerow(["url"])
-        for url in sorted(urls):
-            writer.writerow([url])
+        fh.write(text)
+
+
+def _worker_count(value: str) -> int:
+    try:
+        workers = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}") from None
+    if not 1 <= workers <= MAX_WORKERS_LIMIT:
+        raise argparse.ArgumentTypeError(f"must be between 1 and {MAX_WORKERS_LIMIT}, got {workers}")
+    return workers
 
 
 def parse_args() -> argparse.Namespace:
@@ -129,24 +491,60 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Emit paths only (strip the scheme+host from each URL).",
     )
+    parser.add_argument(
+        "--max-workers",
+        type=_worker_count,
+        default=DEFAULT_MAX_WORKERS,
+        help=(
+            f"Number of sitemaps to fetch in parallel (defaults to {DEFAULT_MAX_WORKERS}, "
+            f"at most {MAX_WORKERS_LIMIT})."
+        ),
+    )
+    parser.add_argument(
+        "--strict-xml",
+        action="store_true",
+        help="Parse every sitemap as XML instead of scanning the raw bytes for <loc> tags.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory for cached sitemap downloads (defaults to {DEFAULT_CACHE_DIR}).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always download sitemaps instead of reusing cached copies.",
+    )
+    parser.add_argument(
+        "--sorted",
+        action="store_true",
+        help="Sort the CSV (URLs are otherwise written in discovery order as the crawl runs).",
+    )
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
+    options = dict(
+        cert_file=args.cert_file,
+        strip_domain=args.strip_domain,
+        max_workers=args.max_workers,
+        strict_xml=args.strict_xml,
+        cache_dir=None if args.no_cache else args.cache_dir,
+    )
 
     try:
-        collected = collect_urls(
-            args.sitemap,
-            cert_file=args.cert_file,
-            strip_domain=args.strip_domain,
-        )
+        if args.sorted:
+            collected = collect_urls(args.sitemap, **options)
+            write_csv(collected, args.output)
+            count = len(collected)
+        else:
+            count = stream_csv(args.sitemap, args.output, **options)
     except Exception as err:  # pragma: no cover
         print(f"Failed to parse sitemap: {err}", file=sys.stderr)
         sys.exit(1)
 
-    write_csv(collected, args.output)
-    print(f"Wrote {len(collected)} unique URLs to {args.output}")
+    print(f"Wrote {count} unique URLs to {args.output}")
 
 
 if __name__ == "__main__":
@@ -6,24 +6,45 @@ Users can supply any sitemap XML URL, then download all discovered URLs as CSV.
 
 from __future__ import annotations
 
-import csv
-import io
-
 import certifi
 import streamlit as st
 
-from sitemap_to_csv import collect_urls
+from sitemap_to_csv import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_MAX_WORKERS,
+    MAX_WORKERS_LIMIT,
+    collect_urls,
+    format_csv,
+)
 
 DEFAULT_SITEMAP = "https://paen.com/sitemap.xml"
 
 
-def _build_csv(urls: set[str]) -> str:
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(["url"])
-    for url in sorted(urls):
-        writer.writerow([url])
-    return buffer.getvalue()
+def _collect_sorted(
+    sitemap_url: str,
+    cert_file: str | None,
+    strip_domain: bool,
+    max_workers: int,
+    cache_dir: str | None,
+) -> list[str]:
+    # Sorted once here; both the CSV and the sample reuse this list.
+    return sorted(
+        collect_urls(
+            sitemap_url,
+            cert_file=cert_file,
+            strip_domain=strip_domain,
+            max_workers=max_workers,
+            cache_dir=cache_dir,
+        )
+    )
+
+
+# Reruns with the same inputs skip the crawl entirely while caching is enabled.
+_cached_collect = st.cache_data(ttl=3600, show_spinner=False, max_entries=32)(_collect_sorted)
+
+
+def _build_csv(urls: list[str]) -> str:
+    return format_csv(urls)
 
 
 st.set_page_config(page_title="Sitemap to CSV", page_icon="🗺️")
@@ -35,6 +56,10 @@ with st.form("sitemap_form"):
     output_name = st.text_input("CSV file name", "sitemap_links.csv")
     use_certifi = st.checkbox("Use certifi CA bundle (recommended)", value=True)
     strip_domain = st.checkbox("Strip scheme+host (keep only path/query/fragment)", value=True)
+    max_workers = st.number_input(
+        "Parallel sitemap fetches", min_value=1, max_value=MAX_WORKERS_LIMIT, value=DEFAULT_MAX_WORKERS
+    )
+    use_cache = st.checkbox("Reuse sitemaps downloaded in the last hour", value=True)
     submitted = st.form_submit_button("Collect URLs")
 
 if submitted:
@@ -45,11 +70,12 @@ if submitted:
         cert_file = certifi.where() if use_certifi else None
         try:
             with st.spinner("Collecting URLs…"):
-                urls = collect_urls(
-                    sitemap_url,
-                    cert_file=cert_file,
-                    strip_domain=strip_domain,
-                )
+                if use_cache:
+                    urls = _cached_collect(
+                        sitemap_url, cert_file, strip_domain, int(max_workers), DEFAULT_CACHE_DIR
+                    )
+                else:
+                    urls = _collect_sorted(sitemap_url, cert_file, strip_domain, int(max_workers), None)
         except Exception as exc:
             st.error(f"Failed to collect URLs: {exc}")
         else:
@@ -63,5 +89,5 @@ if submitted:
             if urls:
                 st.divider()
                 st.caption("Sample URLs")
-                st.dataframe([[url] for url in sorted(urls)[:10]], columns=["url"])
+                st.dataframe([[url] for url in urls[:10]], columns=["url"])
 
@@ -0,0 +1,191 @@
+import csv
+import io
+import json
+
+import pytest
+
+import sitemap_to_csv
+
+SITEMAP_URL = "https://example.com/sitemap.xml"
+XMLNS = f'xmlns="{sitemap_to_csv.XML_NAMESPACE}"'
+
+
+def _read_sitemap(monkeypatch, tmp_path, data: bytes, strict_xml: bool):
+    monkeypatch.setattr(sitemap_to_csv, "fetch_xml", lambda url, cert_file=None, cache_dir=None: data)
+    # With a cache_dir the strict path also goes through fetch_xml instead of streaming a response.
+    return sitemap_to_csv.read_sitemap(SITEMAP_URL, strict_xml=strict_xml, cache_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize("strict_xml", [False, True])
+def test_read_sitemap_skips_sitemap_without_loc(monkeypatch, tmp_path, strict_xml):
+    data = (
+        f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex {XMLNS}>'
+        "<sitemap><lastmod>2024-01-01</lastmod></sitemap>"
+        "<sitemap><loc>https://example.com/posts.xml</loc></sitemap>"
+        "</sitemapindex>"
+    ).encode()
+    assert _read_sitemap(monkeypatch, tmp_path, data, strict_xml) == (["https://example.com/posts.xml"], [])
+
+
+@pytest.mark.parametrize("strict_xml", [False, True])
+def test_read_sitemap_splits_urlset_entries(monkeypatch, tmp_path, strict_xml):
+    data = (
+        f"<urlset {XMLNS}>"
+        "<url><loc>https://example.com/a?x=1&amp;y=2</loc></url>"
+        "<url><loc>https://example.com/nested.xml.gz</loc></url>"
+        "<url><lastmod>2024-01-01</lastmod></url>"
+        "</urlset>"
+    ).encode()
+    assert _read_sitemap(monkeypatch, tmp_path, data, strict_xml) == (
+        ["https://example.com/nested.xml.gz"],
+        ["https://example.com/a?x=1&y=2"],
+    )
+
+
+@pytest.mark.parametrize("strict_xml", [False, True])
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"<html><body><loc>https://example.com/a</loc></body></html>",
+        b'<urlset xmlns="http://example.com/other"><url><loc>https://example.com/a</loc></url></urlset>',
+        b"<urlset><url><loc>https://example.com/a</loc></url></urlset>",
+    ],
+    ids=["html", "foreign-namespace", "no-namespace"],
+)
+def test_read_sitemap_rejects_unsupported_root(monkeypatch, tmp_path, data, strict_xml):
+    with pytest.raises(ValueError, match="Unsupported sitemap root tag"):
+        _read_sitemap(monkeypatch, tmp_path, data, strict_xml)
+
+
+@pytest.mark.parametrize("strict_xml", [False, True])
+def test_read_sitemap_honours_declared_encoding(monkeypatch, tmp_path, strict_xml):
+    data = (
+        f'<?xml version="1.0" encoding="ISO-8859-1"?><urlset {XMLNS}>'
+        "<url><loc>http://x.com/café</loc></url>"
+        "</urlset>"
+    ).encode("latin-1")
+    assert _read_sitemap(monkeypatch, tmp_path, data, strict_xml) == ([], ["http://x.com/café"])
+
+
+def test_read_sitemap_falls_back_to_parser_on_invalid_utf8(monkeypatch, tmp_path):
+    data = f"<urlset {XMLNS}><url><loc>http://x.com/café</loc></url></urlset>".encode("latin-1")
+    parsed = []
+
+    def fake_parse_entries(source):
+        parsed.append(source.read())
+        return [], []
+
+    monkeypatch.setattr(sitemap_to_csv, "_parse_entries", fake_parse_entries)
+    assert _read_sitemap(monkeypatch, tmp_path, data, strict_xml=False) == ([], [])
+    assert parsed == [data]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "<url><loc>   </loc></url><url><loc> https://example.com/a </loc></url>",
+        "<!-- <url><loc>https://example.com/old</loc></url> --><url><loc>https://example.com/a</loc></url>",
+        "<url><loc><![CDATA[https://example.com/b]]></loc></url><url><loc>https://example.com/a</loc></url>",
+    ],
+    ids=["blank-loc", "comment", "mixed-cdata"],
+)
+def test_read_sitemap_fast_path_matches_strict_parser(monkeypatch, tmp_path, body):
+    data = f"<urlset {XMLNS}>{body}</urlset>".encode()
+    fast = _read_sitemap(monkeypatch, tmp_path, data, strict_xml=False)
+    assert fast == _read_sitemap(monkeypatch, tmp_path, data, strict_xml=True)
+    assert fast[1][-1] == "https://example.com/a"
+
+
+class _FakeResponse:
+    def __init__(self, status=200, data=b"", headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+
+def _stub_request(monkeypatch, *responses):
+    """Make _request return the given responses in order, recording the headers sent."""
+    sent = []
+    queue = list(responses)
+
+    def fake_request(url, cert_file=None, headers=None, **kwargs):
+        sent.append(headers or {})
+        return queue.pop(0)
+
+    monkeypatch.setattr(sitemap_to_csv, "_request", fake_request)
+    return sent
+
+
+def _age_cache(cache_dir):
+    (meta_path,) = cache_dir.glob("*.meta.json")
+    meta = json.loads(meta_path.read_text())
+    meta["fetched_at"] = 0
+    meta_path.write_text(json.dumps(meta))
+    return meta_path
+
+
+def test_fetch_xml_serves_fresh_cache_without_request(monkeypatch, tmp_path):
+    sent = _stub_request(monkeypatch, _FakeResponse(data=b"<urlset/>"))
+    assert sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(tmp_path)) == b"<urlset/>"
+    assert sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(tmp_path)) == b"<urlset/>"
+    assert len(sent) == 1
+
+
+def test_fetch_xml_revalidates_stale_cache(monkeypatch, tmp_path):
+    first = _FakeResponse(
+        data=b"<old/>",
+        headers={"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+    )
+    sent = _stub_request(monkeypatch, first, _FakeResponse(data=b"<new/>"))
+    sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(tmp_path))
+    _age_cache(tmp_path)
+
+    assert sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(tmp_path)) == b"<new/>"
+    assert sent[1] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+    }
+
+
+def test_fetch_xml_reuses_cached_body_on_304(monkeypatch, tmp_path):
+    _stub_request(
+        monkeypatch,
+        _FakeResponse(data=b"<urlset/>", headers={"ETag": '"v1"'}),
+        _FakeResponse(status=304),
+    )
+    sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(tmp_path))
+    meta_path = _age_cache(tmp_path)
+
+    assert sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(tmp_path)) == b"<urlset/>"
+    meta = json.loads(meta_path.read_text())
+    assert meta["fetched_at"] > 0
+    assert meta["etag"] == '"v1"'
+
+
+def test_fetch_xml_ignores_unwritable_cache(monkeypatch, tmp_path):
+    not_a_dir = tmp_path / "cache"
+    not_a_dir.write_text("")
+    _stub_request(monkeypatch, _FakeResponse(data=b"<urlset/>"))
+    assert sitemap_to_csv.fetch_xml(SITEMAP_URL, cache_dir=str(not_a_dir)) == b"<urlset/>"
+
+
+@pytest.mark.parametrize(
+    "urls",
+    [
+        [],
+        [""],
+        ["", ":"],
+        [":", "", "b"],
+        ["https://example.com/a", "/b?x=1"],
+        ["a,b"],
+        ['a"b'],
+        ["a\nb"],
+        ["a\rb", "c"],
+    ],
+)
+def test_format_csv_matches_csv_writer(urls):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["url"])
+    writer.writerows([url] for url in urls)
+    assert sitemap_to_csv.format_csv(urls) == buffer.getvalue()